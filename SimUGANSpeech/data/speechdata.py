@@ -15,10 +15,9 @@ import sys
 
 import time
 
-import pickle
 import copy
 
-from SimUGANSpeech.util.data_util import randomly_sample_stack, truncate, pad_or_truncate, randomly_split
+from SimUGANSpeech.util.data_util import randomly_sample_stack, truncate, pad_or_truncate, randomly_split, load_master
 from SimUGANSpeech.util.audio_util import get_audio_features 
 from SimUGANSpeech.preprocessing.audio import AudioParams
 
@@ -62,15 +61,14 @@ def load_speech_data(folder_dir, folder_names):
         return []
     for fname in folder_names:
         fpath = os.path.join(folder_dir, fname)
-        master_path = os.path.join(fpath, 'master.pkl')
 
         try:
-            master = pickle.load(open(master_path, 'rb'))
+            master = load_master(fpath)
         except:
             raise RuntimeError("""
-                There was a problem with loading the master file, {0}.\n
+                There was a problem with loading the master file in {0}.\n
                 Make sure the data is preprocessed. Check in /scripts
-            """.format(master_path)) 
+            """.format(fpath))
         audio_files += master['paths']
         transcriptions += master['transcriptions']
         ids += master['ids']
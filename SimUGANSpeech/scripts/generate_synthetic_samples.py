@@ -27,7 +27,7 @@ import argparse
 from SimUGANSpeech.definitions import SYNTHETIC_DIR
 from SimUGANSpeech.definitions import LIBRISPEECH_DIR 
 from SimUGANSpeech.data.librispeechdata import POSSIBLE_FOLDERS
-from SimUGANSpeech.util.data_util import chunkify
+from SimUGANSpeech.util.data_util import chunkify, load_master
 import SimUGANSpeech.util.audio_util as audio_util
 
 from deco import concurrent, synchronized
@@ -55,14 +55,13 @@ def get_librispeech_texts(folder_paths):
         if not os.path.exists(fpath):
             raise ValueError("{0} doesn't exist".format(fpath))
 
-        master_path = os.path.join(fpath, 'master.pkl')
         try:
-            master = pickle.load(open(master_path, 'rb'))
+            master = load_master(fpath)
         except:
             raise RuntimeError("""
-                There was a problem with loading the master file, {0}.\n
+                There was a problem with loading the master file in {0}.\n
                 Make sure librispeech_initialize.py is run in /scripts
-            """.format(master_path)) 
+            """.format(fpath))
 
         transcriptions = master['transcriptions']
 
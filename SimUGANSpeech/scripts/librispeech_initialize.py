@@ -55,12 +55,16 @@ Todo:
 import numpy as np
 import os
 
-import urllib
-import pickle
 import json
 import tarfile
-import sys
-import re
+
+import concurrent.futures
+import itertools
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from tqdm import tqdm
 
 import argparse
 
@@ -72,6 +76,20 @@ from SimUGANSpeech.data.librispeechdata import POSSIBLE_FOLDERS
 
 LIBRISPEECH_URL_BASE = "http://www.openslr.org/resources/12/{0}"
 
+# argparse turns '--dev-clean' into the attribute 'dev_clean', so keep the
+# folder name -> argument key mapping precomputed.
+_FOLDER_KEYS = [(folder, folder.replace("-", "_")) for folder in POSSIBLE_FOLDERS]
+
+# Shared session so downloads reuse connections (keep-alive) and retry
+# transient failures with backoff instead of dying mid-archive.
+_SESSION = requests.Session()
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4,
+                       max_retries=Retry(total=5, backoff_factor=1))
+_SESSION.mount('http://', _adapter)
+_SESSION.mount('https://', _adapter)
+
+_DOWNLOAD_CHUNK_SIZE = 1 << 20
+
 def _voice_txt_dict_from_path(folder_path):
     """Creates a dictionary between voice ids and txt file paths
 
@@ -87,12 +105,25 @@ def _voice_txt_dict_from_path(folder_path):
     """
     voice_txt_dict = {}
 
-    for dir_name, sub_directories, file_names in os.walk(folder_path):
-        if len(sub_directories) == 0: # this is a root directory
-            file_names = list(map(lambda x: os.path.join(dir_name, x), file_names))
-            txt_file = list(filter(lambda x: x.endswith('txt'), file_names))[0]
-
-            voice_id = os.path.basename(dir_name)
+    # Explicit DFS with os.scandir rather than os.walk. DirEntry caches the
+    # results of stat(), so is_dir/is_file don't cost an extra syscall per
+    # entry, which matters for the larger LibriSpeech folders.
+    stack = [folder_path]
+    while stack:
+        dir_path = stack.pop()
+        has_subdirectories = False
+        txt_file = None
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    has_subdirectories = True
+                    stack.append(entry.path)
+                elif txt_file is None and entry.name.endswith('.trans.txt') \
+                        and entry.is_file(follow_symlinks=False):
+                    txt_file = entry.path
+
+        if not has_subdirectories and txt_file is not None: # this is a root directory
+            voice_id = os.path.basename(dir_path)
 
             if voice_id not in voice_txt_dict:
                 voice_txt_dict[voice_id] = [txt_file]
@@ -101,11 +132,57 @@ def _voice_txt_dict_from_path(folder_path):
 
     return voice_txt_dict
 
+def _read_trans_txt(txt_file_path):
+    """Read a trans.txt file into memory.
+
+    Kept separate from parsing so the thread pool in
+    flacpath_transcription_id only spends its time on I/O.
+
+    Args:
+        txt_file_path (str): The path to a trans.txt file
+
+    Returns:
+        str : The decoded contents of the file
+    """
+    # trans.txt files are small, so slurp the whole buffer in one read.
+    with open(txt_file_path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def _parse_trans_txt(txt_file_path, contents):
+    """Parse the in-memory contents of a trans.txt file.
+
+    Pure CPU work; the contents come from _read_trans_txt.
+
+    Args:
+        txt_file_path (str): The path the contents were read from
+        contents (str): The decoded contents of the file
+
+    Returns:
+        list : A list of transcriptions
+        list : A list of paths to .flac files
+    """
+    # Every flac referenced by a trans.txt lives next to it, so the path
+    # prefix can be built once and each line costs a single concatenation.
+    flac_prefix = os.path.dirname(txt_file_path) + os.sep
+
+    # The format of each line is '<file name> <transcription>', so one
+    # split on the first space separates the two columns. A line with no
+    # space (an utterance with an empty transcription) degrades to ''.
+    pairs = [line.split(' ', 1) if ' ' in line else (line, '')
+             for line in contents.splitlines() if line]
+
+    transcriptions = [transcription for _, transcription in pairs]
+    flac_files = [flac_prefix + file_name + ".flac" for file_name, _ in pairs]
+
+    return transcriptions, flac_files
+
+
 def _transcriptions_and_flac(txt_file_path):
     """Gets the transcriptions and .flac files from the path to a trans.txt file.
 
-    Given the path to a trans.txt file, this function will return a list of 
-    transcriptions and a list of the .flac files. Each flac file entry index corresponds 
+    Given the path to a trans.txt file, this function will return a list of
+    transcriptions and a list of the .flac files. Each flac file entry index corresponds
     to the transcription entry index.
 
     Args:
@@ -115,21 +192,7 @@ def _transcriptions_and_flac(txt_file_path):
         list : A list of transcriptions
         list : A list of paths to .flac files
     """
-    transcriptions = []
-    flac_files = []
-
-    parent_dir_path = os.path.dirname(txt_file_path)
-
-    with open(txt_file_path, 'rb') as f:
-        lines = [x.decode('utf8').strip() for x in f.readlines()]
-    
-    for line in lines:
-        splitted = re.split(' ', line)
-        file_name = splitted[0]
-        transcriptions.append(" ".join(splitted[1:]))
-        flac_files.append(os.path.join(parent_dir_path, "{0}.flac".format(file_name)))
- 
-    return transcriptions, flac_files 
+    return _parse_trans_txt(txt_file_path, _read_trans_txt(txt_file_path))
 
 
 def flacpath_transcription_id(folder_path):
@@ -139,37 +202,76 @@ def flacpath_transcription_id(folder_path):
         folder_path (str): Path to the folder
 
     Returns:
-        dict: Contains flac files, transcriptions, and ids
+        dict: Contains flac files, transcriptions, and dictionary-encoded
+            ids ('voice_ids' holds each unique id once, 'id_idx' maps
+            each utterance to an index into it)
 
     """
     voice_txt_dict = _voice_txt_dict_from_path(folder_path)
-    
-    flac_files = []
-    transcriptions = []
-    ids = []
 
+    txt_files = []
+    voice_ids = []
     for voice_id in voice_txt_dict:
-        txt_files = voice_txt_dict[voice_id]
-        for txt_file in txt_files:
-            t, flacs = _transcriptions_and_flac(txt_file)
-            flac_files += flacs
-            transcriptions += t
-            ids += [voice_id] * len(flacs)
-
-    return {'paths': flac_files, 'transcriptions': transcriptions, 'ids': ids}
+        for txt_file in voice_txt_dict[voice_id]:
+            txt_files.append(txt_file)
+            voice_ids.append(voice_id)
 
+    # Voice ids repeat for every utterance of a speaker, so store each
+    # unique id once plus an int32 index per utterance instead of the
+    # full string per row. Downstream reconstructs via voice_ids[id_idx].
+    unique_voice_ids = list(voice_txt_dict)
+    voice_index = {voice_id: i for i, voice_id in enumerate(unique_voice_ids)}
 
-def _print_download_progress(count, block_size, total_size):
-    """Print the download progress.
+    flac_files = []
+    transcriptions = []
+    idx_per_utterance = []
+
+    # Each trans.txt is tiny and independent, so reading is dominated by
+    # open/read syscalls. Batch the reads through a thread pool so they
+    # overlap, submitting one wave at a time and draining it into the
+    # output columns before the next, so read-ahead buffers are bounded
+    # by the wave size rather than the whole folder.
+    max_workers = (os.cpu_count() or 1) * 4
+    read_ahead = max_workers * 4
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for start in range(0, len(txt_files), read_ahead):
+            batch_files = txt_files[start:start + read_ahead]
+            batch_voice_ids = voice_ids[start:start + read_ahead]
+            buffers = executor.map(_read_trans_txt, batch_files)
+            for txt_file, voice_id, contents in zip(batch_files, batch_voice_ids, buffers):
+                t, flacs = _parse_trans_txt(txt_file, contents)
+                transcriptions.extend(t)
+                flac_files.extend(flacs)
+                idx_per_utterance.extend(
+                    itertools.repeat(voice_index[voice_id], len(flacs)))
+
+    return {'paths': flac_files,
+            'transcriptions': transcriptions,
+            'voice_ids': np.asarray(unique_voice_ids),
+            'id_idx': np.asarray(idx_per_utterance, dtype=np.int32)}
+
+
+def _download_file(url, file_path, verbose):
+    """Stream a file from a url to disk through the shared session.
 
-    Used as a callback in _maybe_download_and_extract.
+    Args:
+        url (str): The url to download from
+        file_path (str): The destination path
+        verbose (bool): Whether or not to print progress
 
     """
-    pct_complete = float(count * block_size) / total_size
-    msg = "\r- Download progress: {0:.1%}".format(pct_complete)
-
-    sys.stdout.write(msg)
-    sys.stdout.flush()
+    with _SESSION.get(url, stream=True) as r:
+        r.raise_for_status()
+        total_size = int(r.headers.get('Content-Length', 0))
+        # tqdm throttles its own rendering, so progress doesn't cost a
+        # stdout write + flush per chunk.
+        progress = tqdm(total=total_size or None, unit='B', unit_scale=True,
+                        desc=os.path.basename(file_path),
+                        disable=not verbose)
+        with progress, open(file_path, 'wb') as f:
+            for chunk in r.iter_content(_DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+                progress.update(len(chunk))
 
 
 def _maybe_download_and_extract(folder_dir, folder_names, verbose):
@@ -183,41 +285,125 @@ def _maybe_download_and_extract(folder_dir, folder_names, verbose):
 
     """
 
-    if not os.path.exists(folder_dir):
-        if verbose:
-            print ("{0} doesn't exist. Making now.".format(folder_dir))
-        os.makedirs(folder_dir)
+    os.makedirs(folder_dir, exist_ok=True)
 
+    pending = []
     for fname in folder_names:
         if not os.path.exists(os.path.join(folder_dir, fname)):
             tar_file_name = fname + ".tar.gz"
             tar_file_path = os.path.join(folder_dir, tar_file_name)
             url = LIBRISPEECH_URL_BASE.format(tar_file_name)
-            
-            if verbose:
-                print ("{0} not found. Downloading {1}".format(fname, tar_file_name))
 
             if verbose:
+                print ("{0} not found. Downloading {1}".format(fname, tar_file_name))
                 print (url)
-                file_path, _ = urllib.request.urlretrieve(url=url,
-                                                          filename=tar_file_path,
-                                                          reporthook=_print_download_progress)
-                print ()
-                print ("Download complete. Extracting {0}".format(tar_file_path))
-            else:
-                file_path, _ = urllib.request.urlretrieve(url=url,
-                                                          filename=tar_file_path)
-            tarfile.open(name=tar_file_path, mode="r:gz").extractall(os.path.join(folder_dir, '..'))
+            pending.append((fname, url, tar_file_path))
         else:
             if verbose:
                 print ("{0} found. Skipping download...".format(fname))
 
+    if not pending:
+        return
+
+    # Per-chunk progress from several threads would garble the terminal,
+    # so only show it when a single archive is being fetched.
+    show_progress = verbose and len(pending) == 1
+    extract_dir = os.path.join(folder_dir, '..')
+
+    # A single connection rarely saturates the link, so fetch archives in
+    # parallel and extract each one as soon as its download finishes.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(4, len(pending))) as executor:
+        futures = {executor.submit(_download_file, url, tar_file_path, show_progress):
+                   (fname, tar_file_path)
+                   for fname, url, tar_file_path in pending}
+        for future in concurrent.futures.as_completed(futures):
+            fname, tar_file_path = futures[future]
+            future.result()
+            if verbose:
+                print ("Download of {0} complete. Extracting {1}".format(fname, tar_file_path))
+            # Stream mode ('r|gz') decompresses in a single forward pass with
+            # a small buffer instead of seeking around the archive, and the
+            # with block makes sure the tarfile is actually closed.
+            with tarfile.open(name=tar_file_path, mode="r|gz") as tar:
+                tar.extractall(extract_dir)
+
+
+
+def _folder_signature(fpath):
+    """Compute a cheap signature for a LibriSpeech folder.
+
+    Used to decide whether the preprocessed master file is stale without
+    walking the whole tree.
+
+    Args:
+        fpath (str): The path to the folder (e.g., /path/to/dev-clean)
+
+    Returns:
+        dict : The folder's mtime and number of top-level entries
+
+    """
+    st = os.stat(fpath)
+    with os.scandir(fpath) as entries:
+        num_entries = sum(1 for _ in entries)
+    return {'mtime_ns': st.st_mtime_ns, 'num_entries': num_entries}
+
+
+def _process_folder(folder_dir, fname, verbose, force):
+    """Preprocess a single LibriSpeech folder and save its master file.
+
+    Kept at module level so it can be pickled into worker processes by
+    librispeech_initialize.
+
+    Args:
+        folder_dir (str): The path to LibriSpeech
+        fname (str): The folder name (e.g., dev-clean)
+        verbose (bool): Whether or not to print progress
+        force (bool): Whether or not to reprocess folders
+            whose master file is already up to date.
+
+    """
+    if verbose:
+        print ("Processing {0}".format(fname))
+    fpath = os.path.join(folder_dir, fname)
+    master_file_path = os.path.join(fpath, 'master.npz')
+    meta_file_path = os.path.join(fpath, 'master.meta.json')
+    if not os.path.exists(fpath):
+        raise ValueError("{0} does not exist. Make sure you download the data first.".format(fpath))
+
+    # Preprocessing is deterministic, so if the folder hasn't changed
+    # since the last run we can reuse the existing master file.
+    if not force and os.path.exists(master_file_path):
+        try:
+            with open(meta_file_path, 'r') as f:
+                cached_signature = json.load(f)
+        except (OSError, IOError, ValueError):
+            cached_signature = None
+        if cached_signature == _folder_signature(fpath):
+            if verbose:
+                print ("{0} is unchanged. Skipping...".format(fname))
+            return
+
+    data = flacpath_transcription_id(fpath)
+    # .npz loads noticeably faster than a pickled dict of lists, since
+    # numpy reads the string arrays in bulk instead of object by object.
+    np.savez(master_file_path,
+             paths=np.asarray(data['paths']),
+             transcriptions=np.asarray(data['transcriptions']),
+             voice_ids=data['voice_ids'],
+             id_idx=data['id_idx'])
+    # Both outputs live inside the folder being fingerprinted, so the
+    # signature is only valid once they exist: creating them bumps the
+    # folder's mtime and entry count, while writing contents into the
+    # already-created sidecar below does not.
+    with open(meta_file_path, 'w') as f:
+        json.dump(_folder_signature(fpath), f)
 
 
 def librispeech_initialize(folder_dir,
                            folder_names,
                            save_folder,
-                           verbose):
+                           verbose,
+                           force=False):
     """Download LibriSpeech data, preprocess and save 
 
     For specified LibriSpeech datasets, extract:
@@ -233,7 +419,7 @@ def librispeech_initialize(folder_dir,
     {save_folder}/dev
 
     A master file is saved as well that specifies information about preprocessing.
-    This is saved to /path/to/dev-clean/master.pkl.
+    This is saved to /path/to/dev-clean/master.npz.
 
     Args:
         folder_dir (str): The path to LibriSpeech 
@@ -241,17 +427,23 @@ def librispeech_initialize(folder_dir,
             (e.g., dev-clean, dev-test, etc.)
         save_folder (str): The path to the destination to save pkl data
         verbose (bool): Whether or not to print progress
+        force (:obj:`bool`, optional): Whether or not to reprocess folders
+            whose master file is already up to date.
+            Defaults to False
 
     """
-    for fname in folder_names:
-        if verbose:
-            print ("Processing {0}".format(fname))
-        fpath = os.path.join(folder_dir, fname)
-        master_file_path = os.path.join(fpath, 'master.pkl')
-        if not os.path.exists(fpath):
-            raise ValueError("{0} does not exist. Make sure you download the data first.".format(fpath))
-        data = flacpath_transcription_id(fpath)
-        pickle.dump(data, open(master_file_path, 'wb'))
+    if len(folder_names) <= 1:
+        for fname in folder_names:
+            _process_folder(folder_dir, fname, verbose, force)
+        return
+
+    # Folders are disjoint trees, so process them in separate processes.
+    # Each worker still overlaps its own trans.txt reads with threads.
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(folder_names)) as executor:
+        futures = [executor.submit(_process_folder, folder_dir, fname, verbose, force)
+                   for fname in folder_names]
+        for future in futures:
+            future.result()
 
 
 if __name__ == '__main__':
@@ -269,6 +461,9 @@ if __name__ == '__main__':
     parser.add_argument("--all", action='store_true',
                         help="Include all possible folders")
 
+    parser.add_argument("--force", action='store_true',
+                        help="Reprocess folders even if their master file is up to date")
+
     # Verbosity
     parser.add_argument("--verbose", action='store_true',
                         help="Verbosity")
@@ -277,17 +472,14 @@ if __name__ == '__main__':
     args = parser.parse_args()
 
     folder_dir = LIBRISPEECH_DIR
-    folder_names = []
+    arg_dict = vars(args)
 
     # Get all paths to LibriSpeech data
     if args.all:
         folder_names = POSSIBLE_FOLDERS
     else:
-        for folder in POSSIBLE_FOLDERS:
-            # Optional arguments mess up the folder names.
-            folder_key = folder.replace("-", "_") 
-            if vars(args)[folder_key]:
-                folder_names.append(folder)
+        folder_names = [folder for folder, folder_key in _FOLDER_KEYS
+                        if arg_dict[folder_key]]
 
     if args.verbose:
         print ("Processing: ")
@@ -302,12 +494,15 @@ if __name__ == '__main__':
             print ("Files being deleted:")
         for fname in folder_names:
             fpath = os.path.join(save_dir, fname)
-            if os.path.exists(fpath):
-                pkl_files = [os.path.join(save_dir, fname, f) for f in os.listdir(fpath) if f.endswith(".pkl")]
-                for f in pkl_files:
-                    if args.verbose:
-                        print ("{0}".format(f))
-                    os.remove(f)
+            try:
+                with os.scandir(fpath) as entries:
+                    for entry in entries:
+                        if entry.name.endswith((".pkl", ".npz", ".meta.json")):
+                            if args.verbose:
+                                print ("{0}".format(entry.path))
+                            os.remove(entry.path)
+            except FileNotFoundError:
+                continue
         if args.verbose:
             print ("Completed cleaning process.")
 
@@ -319,4 +514,5 @@ if __name__ == '__main__':
     if args.verbose:
         print ("-----------------------------------")
         print ("Beginning initialization")
-    librispeech_initialize(folder_dir, folder_names, save_dir, args.verbose)
+    librispeech_initialize(folder_dir, folder_names, save_dir, args.verbose,
+                           force=args.force)
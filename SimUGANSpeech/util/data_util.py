@@ -4,6 +4,7 @@
 This module is used to provide helper functions for any data related
 operations. Included functions:
 
+    - load_master
     - chunkify
     - randomly_sample_stack
     - pad_or_truncate
@@ -11,12 +12,47 @@ operations. Included functions:
 Todo:
 
 """
+import os
+import pickle
+
 import numpy as np
 import copy
 import tensorflow as tf
 
 from deco import concurrent, synchronized
 
+def load_master(fpath):
+    """Load the master file for a preprocessed folder.
+
+    Prefers the master.npz format written by the current preprocessing
+    scripts, falling back to the legacy master.pkl pickle for folders
+    processed by older runs.
+
+    Args:
+        fpath (str): The path to the preprocessed folder
+
+    Returns:
+        dict: Contains flac files, transcriptions, and ids
+
+    """
+    npz_path = os.path.join(fpath, 'master.npz')
+    if os.path.exists(npz_path):
+        with np.load(npz_path) as npz:
+            master = {key: npz[key] for key in npz.files}
+        if 'id_idx' in master:
+            # ids are dictionary-encoded: each unique voice id is stored
+            # once and id_idx maps utterances back to it.
+            ids = master['voice_ids'][master['id_idx']].tolist()
+        else:
+            ids = master['ids'].tolist()
+        return {'paths': master['paths'].tolist(),
+                'transcriptions': master['transcriptions'].tolist(),
+                'ids': ids}
+    with open(os.path.join(fpath, 'master.pkl'), 'rb') as f:
+        return pickle.load(f)
+
+
+
 def chunkify(l, num_chunks):
     """Break a list into N different lists of equal size
 